@@ -1,10 +1,236 @@
-from django.contrib import admin
+import json
+
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models.functions import Substr
+from django.shortcuts import render
+from django.utils.functional import cached_property
+from .compression import PREVIEW_LENGTH
 from .models import Email
-from .models import User  
+from .models import User
 from django.contrib.auth.admin import UserAdmin
 
+
+# Query string parameter carrying the id of the last email on the previous page
+CURSOR_VAR = 'cursor'
+
+
+def estimate_rows(model, using):
+    # The row count the database keeps in its statistics, which costs nothing to read, unlike COUNT(*)
+    # over millions of rows.  SQLite keeps no such statistic, so the highest id stands in for it
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() '
+                'AND table_name = %s', [table]
+            )
+        else:
+            cursor.execute(f"SELECT MAX({connection.ops.quote_name(model._meta.pk.column)}) FROM "
+                           f"{connection.ops.quote_name(table)}")
+        row = cursor.fetchone()
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+
+def chunked(queryset, chunk_size):
+    # Yields the selected rows' primary keys chunk_size at a time, walking the primary key index rather
+    # than using OFFSET, so each bulk action runs as many short statements instead of one long one
+    queryset = queryset.order_by('pk')
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(pk__gt=last)
+        pks = list(page.values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return
+        yield pks
+        last = pks[-1]
+
+
+def estimate_query_rows(queryset):
+    # The number of rows the query planner expects queryset to return, read from EXPLAIN without running
+    # the query.  SQLite's planner doesn't estimate row counts, so there it's None
+    connection = connections[queryset.db]
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+        if connection.vendor == 'mysql':
+            cursor.execute(f'EXPLAIN {sql}', params)
+            columns = [column[0].lower() for column in cursor.description]
+            row = dict(zip(columns, cursor.fetchone()))
+            return int(row['rows'] * float(row.get('filtered') or 100) / 100)
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    # Once the table is past MAIL_ADMIN_ESTIMATE_THRESHOLD rows, changelists show estimates instead of
+    # running COUNT(*): the statistics row count when unfiltered, and the query planner's estimate when
+    # filtered, since a filter like read=False can match most of the table.  On SQLite, which has no
+    # planner estimates, filtered lists still count exactly
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        estimate = estimate_rows(queryset.model, queryset.db)
+        if estimate is None or estimate <= getattr(settings, 'MAIL_ADMIN_ESTIMATE_THRESHOLD', 10000):
+            return super().count
+        if not queryset.query.where:
+            return estimate
+        filtered = estimate_query_rows(queryset)
+        return super().count if filtered is None else filtered
+
+
+class KeysetChangeList(ChangeList):
+    # In the default newest-first ordering, pages are found with 'id < cursor' on the primary key instead
+    # of OFFSET, so the millionth page is as fast as the first.  Sorting by a column falls back to the
+    # normal numbered pages
+
+    def __init__(self, request, *args, **kwargs):
+        # The cursor is taken out of the query string before ChangeList reads it, the way it drops the
+        # page number, so filter, search, sort and facet links all start again from the first page.
+        # Only next_page_url carries it
+        self.cursor_param = request.GET.get(CURSOR_VAR)
+        query = request.GET
+        request.GET = query.copy()
+        request.GET.pop(CURSOR_VAR, None)
+        try:
+            super().__init__(request, *args, **kwargs)
+        finally:
+            request.GET = query
+
+    def get_results(self, request):
+        self.keyset = set(self.queryset.query.order_by) == {'-pk'} and not self.show_all
+        if not self.keyset:
+            return super().get_results(request)
+
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        try:
+            cursor = int(self.cursor_param or 0)
+        except ValueError:
+            raise IncorrectLookupParameters
+        result_list = self.queryset
+        if cursor:
+            result_list = result_list.filter(pk__lt=cursor)
+        result_list = result_list[:self.list_per_page]
+        rows = list(result_list)
+
+        self.cursor = cursor
+        self.next_cursor = rows[-1].pk if len(rows) == self.list_per_page else None
+        self.first_page_url = self.get_query_string()
+        self.next_page_url = self.get_query_string({CURSOR_VAR: self.next_cursor}) if self.next_cursor else None
+        self.result_count = paginator.count
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = result_list
+        self.can_show_all = False
+        self.multi_page = bool(cursor or self.next_cursor)
+        self.paginator = paginator
+
+
 class EmailAdmin(admin.ModelAdmin):
-    list_display = ('user', 'sender', 'subject', 'body', 'timestamp', 'read', 'archived')
+    list_display = ('user', 'sender', 'subject', 'body_preview', 'timestamp', 'read', 'archived')
+    # one join instead of a query per row for user and sender
+    list_select_related = ('user', 'sender')
+    list_filter = ('read', 'archived', 'timestamp')
+    ordering = ('-pk',)
+    paginator = EstimatedCountPaginator
+    # skips the second, unfiltered COUNT(*) next to the filtered one
+    show_full_result_count = False
+    actions = ['mark_read', 'mark_unread', 'archive', 'unarchive', 'delete_in_chunks']
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_queryset(self, request):
+        # The changelist only shows the first characters of each body, so the database cuts it down
+        # instead of sending whole bodies that would be thrown away.  A compressed email's body column
+        # holds just its preview, so the blob is never fetched
+        return super().get_queryset(request).annotate(
+            body_start=Substr('body', 1, PREVIEW_LENGTH)
+        ).defer('body', 'body_compressed')
+
+    def get_actions(self, request):
+        # the stock delete action loads every selected email and everything related to it for its
+        # confirmation page, delete_in_chunks replaces it
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def get_exclude(self, request, obj=None):
+        # A compressed email's body column doesn't hold its text, so the change form shows the decoded
+        # body read-only in its place rather than an editable field that looks empty
+        if obj is not None and obj.body_compressed is not None:
+            return ('body',)
+        return super().get_exclude(request, obj)
+
+    def get_readonly_fields(self, request, obj=None):
+        if obj is not None and obj.body_compressed is not None:
+            return (*super().get_readonly_fields(request, obj), 'decoded_body')
+        return super().get_readonly_fields(request, obj)
+
+    @admin.display(description='body')
+    def decoded_body(self, email):
+        return email.get_body()
+
+    @admin.display(description='body')
+    def body_preview(self, email):
+        return email.body_start
+
+    def update_in_chunks(self, request, queryset, message, **values):
+        chunk_size = getattr(settings, 'MAIL_ADMIN_CHUNK_SIZE', 1000)
+        updated = sum(Email.objects.filter(pk__in=pks).update(**values) for pks in chunked(queryset, chunk_size))
+        self.message_user(request, f"{updated} emails {message}.", messages.SUCCESS)
+
+    @admin.action(description='Mark selected emails as read', permissions=['change'])
+    def mark_read(self, request, queryset):
+        self.update_in_chunks(request, queryset, 'marked as read', read=True)
+
+    @admin.action(description='Mark selected emails as unread', permissions=['change'])
+    def mark_unread(self, request, queryset):
+        self.update_in_chunks(request, queryset, 'marked as unread', read=False)
+
+    @admin.action(description='Archive selected emails', permissions=['change'])
+    def archive(self, request, queryset):
+        self.update_in_chunks(request, queryset, 'archived', archived=True)
+
+    @admin.action(description='Unarchive selected emails', permissions=['change'])
+    def unarchive(self, request, queryset):
+        self.update_in_chunks(request, queryset, 'unarchived', archived=False)
+
+    @admin.action(description='Delete selected emails', permissions=['delete'])
+    def delete_in_chunks(self, request, queryset):
+        # Asks for confirmation first, without listing related objects, then deletes a chunk at a time.
+        # Each chunk is logged and deleted through the same ModelAdmin hooks the stock action uses
+        if request.POST.get('post') != 'yes':
+            return render(request, 'admin/mail/email/delete_in_chunks.html', {
+                **self.admin_site.each_context(request),
+                'opts': self.model._meta,
+                'title': 'Are you sure?',
+                'action_checkbox_name': ACTION_CHECKBOX_NAME,
+                'selected': request.POST.getlist(ACTION_CHECKBOX_NAME),
+                'select_across': request.POST.get('select_across') == '1',
+            })
+        chunk_size = getattr(settings, 'MAIL_ADMIN_CHUNK_SIZE', 1000)
+        deleted = 0
+        for pks in chunked(queryset, chunk_size):
+            deleted += len(pks)
+            # the log only needs each email's id and str(), not its body
+            self.log_deletions(request, Email.objects.filter(pk__in=pks).only('pk'))
+            self.delete_queryset(request, Email.objects.filter(pk__in=pks))
+        self.message_user(request, f"{deleted} emails deleted.", messages.SUCCESS)
 
 # Register your models here.
 admin.site.register(Email, EmailAdmin)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class MailConfig(AppConfig):
     name = 'mail'
+
+    def ready(self):
+        # connects the receivers that keep the cached users in backends.py current
+        from . import backends  # noqa: F401
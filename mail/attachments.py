@@ -0,0 +1,141 @@
+import hashlib
+import os
+import re
+
+from django.conf import settings
+
+
+# Size of each read when hashing a finished upload or copying a request body to disk
+BLOCK_SIZE = 64 * 1024
+
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def root():
+    return getattr(settings, "MAIL_ATTACHMENT_ROOT", os.path.join(settings.BASE_DIR, "attachments"))
+
+
+def upload_path(upload_id):
+    # In-progress uploads live under uploads/ until the last chunk arrives
+    return os.path.join(root(), "uploads", str(upload_id))
+
+
+def blob_path(sha256):
+    # Finished files are content addressed, fanned out over 256 directories by the first byte of the hash
+    return os.path.join(root(), "blobs", sha256[:2], sha256)
+
+
+def write_chunk(upload_id, stream, offset, length):
+    # Copy the request stream straight into the partial file at offset, so a chunk never has to sit in
+    # memory as request.body.  Writing at the offset rather than appending means two requests retrying
+    # the same chunk at once can't interleave their bytes.  Reads at most one byte more than length, so
+    # the caller can tell an oversized chunk apart without it spilling into the next one.  Returns the
+    # number of bytes written
+    path = upload_path(upload_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+        f.seek(offset)
+        remaining = length + 1
+        while remaining > 0:
+            block = stream.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            f.write(block)
+            remaining -= len(block)
+        return length + 1 - remaining
+
+
+def truncate_upload(upload_id, size):
+    # Throw away anything past size, e.g. a chunk that arrived only partly or lost the race to record
+    # itself, so the next attempt can resume exactly at the recorded offset
+    path = upload_path(upload_id)
+    if os.path.exists(path):
+        with open(path, "r+b") as f:
+            f.truncate(size)
+
+
+def finish_upload(upload_id):
+    # Hash the completed file and move it into the blob store.  If the same bytes were uploaded before
+    # the new copy is simply dropped, so every distinct file is on disk exactly once.  Returns the hash
+    path = upload_path(upload_id)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    sha256 = digest.hexdigest()
+    target = blob_path(sha256)
+    if os.path.exists(target):
+        os.remove(path)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+    return sha256
+
+
+def discard_upload(upload_id):
+    try:
+        os.remove(upload_path(upload_id))
+    except FileNotFoundError:
+        pass
+
+
+def parse_content_range(header):
+    # "bytes 0-1048575/5000000" -> (0, 1048575, 5000000), or None if the header is missing or malformed
+    match = CONTENT_RANGE_RE.match(header or "")
+    if match is None:
+        return None
+    start, end, total = (int(value) for value in match.groups())
+    if start > end or end >= total:
+        return None
+    return start, end, total
+
+
+def parse_range(header, size):
+    # Parses a single-range Range request header against a file of the given size.  Returns (start,
+    # end) inclusive, None when there is no usable header (serve the whole file) and raises ValueError
+    # when the range can't be satisfied.  Multi-range requests are answered with the whole file, which
+    # RFC 9110 allows
+    match = RANGE_RE.match(header or "")
+    if match is None or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        # suffix range, "bytes=-500" is the last 500 bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range.")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable.")
+    return start, end
+
+
+class RangeFile:
+    # Read-only view of bytes start..end of an open file.  FileResponse streams it through read() when
+    # running under runserver, while WSGI servers with wsgi.file_wrapper (gunicorn, uwsgi) pick up
+    # fileno() and the current offset and hand the range to sendfile(), so the bytes never pass through
+    # Python at all
+
+    def __init__(self, f, start, end):
+        self.f = f
+        self.f.seek(start)
+        self.remaining = end - start + 1
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def tell(self):
+        return self.f.tell()
+
+    def close(self):
+        self.f.close()
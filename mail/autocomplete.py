@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import Count, F
+
+from .models import Email, User
+
+
+class PrefixIndex:
+    # Every User.email kept in memory as a sorted list, so the addresses starting with a prefix are one
+    # bisect away, plus per-user counts of how often each address appears in that user's mailbox.
+    # Lookups never touch the database.  The index is filled once per process (see project3/wsgi.py)
+    # and kept current by register and compose, but those only update the index of the process that
+    # served them, so a background thread also rebuilds it from the database every
+    # MAIL_AUTOCOMPLETE_MAX_AGE seconds.  Every read and write of the lists and counts holds the lock
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.built = False
+        self.building = False
+        # the process the refresh thread was started in, see start_refresh
+        self.refresh_pid = None
+        self.keys = []
+        self.addresses = []
+        self.weights = defaultdict(Counter)
+
+    def build(self):
+        keys, addresses = [], []
+        for address in User.objects.exclude(email="").values_list("email", flat=True):
+            keys.append(address.lower())
+            addresses.append(address)
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+
+        weights = defaultdict(Counter)
+        # emails received: the sender counts once per email
+        for user_id, address, count in (
+            Email.objects.exclude(sender=F("user")).values_list("user_id", "sender__email")
+            .annotate(count=Count("id"))
+        ):
+            weights[user_id][address] += count
+        # emails sent: each recipient counts once per email
+        for user_id, address, count in (
+            Email.recipients.through.objects.filter(email__sender=F("email__user"))
+            .values_list("email__user_id", "user__email").annotate(count=Count("id"))
+        ):
+            weights[user_id][address] += count
+
+        with self.lock:
+            self.keys = [keys[i] for i in order]
+            self.addresses = [addresses[i] for i in order]
+            self.weights = weights
+            self.built = True
+
+    def rebuild(self):
+        # Builds unless another thread already is, in which case it returns straight away and callers
+        # keep answering from the current index (empty, if it was never built)
+        with self.lock:
+            if self.building:
+                return
+            self.building = True
+        try:
+            self.build()
+        finally:
+            with self.lock:
+                self.building = False
+
+    def ensure_built(self):
+        # Called on the request path, so it only ever builds an index that was never built, such as when
+        # the database wasn't ready at warm().  Keeping a built index fresh is the refresh thread's job
+        if self.refresh_pid is not None and self.refresh_pid != os.getpid():
+            # a forked worker (gunicorn --preload) doesn't inherit the parent's thread
+            self.start_refresh()
+        if not self.built:
+            self.rebuild()
+
+    def start_refresh(self):
+        self.refresh_pid = os.getpid()
+        threading.Thread(target=self.refresh, name="autocomplete-refresh", daemon=True).start()
+
+    def refresh(self):
+        while True:
+            time.sleep(getattr(settings, "MAIL_AUTOCOMPLETE_MAX_AGE", 300))
+            try:
+                self.rebuild()
+            except DatabaseError:
+                pass
+            finally:
+                # this thread's own connection, not held open between rebuilds
+                connection.close()
+
+    def add_user(self, user):
+        if not self.built or not user.email:
+            return
+        with self.lock:
+            key = user.email.lower()
+            position = bisect_left(self.keys, key)
+            self.keys.insert(position, key)
+            self.addresses.insert(position, user.email)
+
+    def add_email(self, sender, recipients):
+        # Called once per composed email: the sender's copy counts every recipient, and each recipient's
+        # copy counts the sender
+        if not self.built:
+            return
+        with self.lock:
+            for recipient in recipients:
+                self.weights[sender.id][recipient.email] += 1
+                if recipient != sender:
+                    self.weights[recipient.id][sender.email] += 1
+
+    def complete(self, user_id, prefix, limit=10):
+        # The caller's own correspondents matching the prefix come first, most frequent first, then the
+        # rest of the matching addresses in alphabetical order
+        prefix = prefix.lower()
+        with self.lock:
+            weights = self.weights.get(user_id, {})
+            results = sorted(
+                (address for address in weights if address.lower().startswith(prefix)),
+                key=lambda address: (-weights[address], address.lower())
+            )[:limit]
+            seen = set(results)
+            position = bisect_left(self.keys, prefix)
+            while len(results) < limit and position < len(self.keys) and self.keys[position].startswith(prefix):
+                address = self.addresses[position]
+                if address not in seen:
+                    results.append(address)
+                position += 1
+        return results
+
+
+index = PrefixIndex()
+
+
+def warm():
+    # Called from wsgi.py and asgi.py so the index is ready before the first request, and kept fresh
+    # after it.  If the database isn't migrated yet the index is simply built on first use instead
+    try:
+        index.build()
+    except DatabaseError:
+        pass
+    index.start_refresh()
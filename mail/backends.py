@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.signals import user_logged_out
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import User
+
+
+def user_cache_key(user_id):
+    return f"mail:user:{user_id}"
+
+
+class CachedModelBackend(ModelBackend):
+    # Same as ModelBackend, except that the user lookup AuthenticationMiddleware does on every request
+    # is served from the cache.  The cached copy is dropped whenever the user is saved (password
+    # changes, admin edits, last_login updates), deleted or logs out, so the session auth hash check in
+    # django.contrib.auth.get_user always sees the current password
+
+    def get_user(self, user_id):
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            cache.set(key, user, getattr(settings, "MAIL_USER_CACHE_TIMEOUT", 300))
+        return user if self.user_can_authenticate(user) else None
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance, **kwargs):
+    cache.delete(user_cache_key(instance.pk))
+
+
+@receiver(user_logged_out)
+def invalidate_logged_out_user(sender, request, user, **kwargs):
+    if user is not None:
+        cache.delete(user_cache_key(user.pk))
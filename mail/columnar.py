@@ -0,0 +1,49 @@
+from .models import Email
+
+
+# Clients opt in to the compact mailbox format by sending this in their Accept header
+CONTENT_TYPE = "application/vnd.mail.columns+json"
+
+
+def wants_columns(request):
+    # Only when the client names the format and prefers it to plain JSON.  A q=0 entry refuses it, and
+    # wildcards like */* match both equally, which keeps plain JSON
+    return request.get_preferred_type(["application/json", CONTENT_TYPE]) == CONTENT_TYPE
+
+
+def encode(emails, grouped=False):
+    # Encodes a mailbox queryset as parallel arrays, one per field, instead of one dict per email, so
+    # key names appear once per response rather than once per row.  Sender and recipient addresses are
+    # replaced by indexes into a shared "addresses" table, and timestamps are epoch seconds for the
+    # client to format.  Bodies and attachments are left out, the listing doesn't show them
+    fields = ["id", "sender__email", "subject", "timestamp", "read", "archived", "thread_id"]
+    if grouped:
+        fields.append("thread_count")
+    rows = list(emails.values_list(*fields))
+    ids = [row[0] for row in rows]
+
+    addresses = {}
+
+    def address(value):
+        return addresses.setdefault(value, len(addresses))
+
+    # one query for every recipient of every listed email, straight from the many to many table
+    recipients = {email_id: [] for email_id in ids}
+    for email_id, value in Email.recipients.through.objects.filter(email_id__in=ids).values_list(
+        "email_id", "user__email"
+    ):
+        recipients[email_id].append(address(value))
+
+    columns = {
+        "id": ids,
+        "sender": [address(row[1]) for row in rows],
+        "recipients": [recipients[email_id] for email_id in ids],
+        "subject": [row[2] for row in rows],
+        "timestamp": [int(row[3].timestamp()) for row in rows],
+        "read": [row[4] for row in rows],
+        "archived": [row[5] for row in rows],
+        "thread_id": [str(row[6]) for row in rows],
+    }
+    if grouped:
+        columns["thread_count"] = [row[7] for row in rows]
+    return {"count": len(rows), "addresses": list(addresses), "columns": columns}
@@ -0,0 +1,70 @@
+import lzma
+import zlib
+
+from django.conf import settings
+from django.db.models.functions import Length
+
+
+# Bodies longer than this many characters get stored compressed.  Short bodies stay as plain text in
+# Email.body, since compressing a few hundred bytes saves nothing and costs a decompress on every read
+DEFAULT_THRESHOLD = 4096
+
+# A compressed email keeps this many leading characters as plain text in Email.body, so listings such as
+# the admin changelist can show the start of it without fetching and decoding the blob
+PREVIEW_LENGTH = 80
+
+# Every compressed blob starts with a one-byte codec marker so we always know how to decode a row, even
+# if MAIL_BODY_CODEC is changed later and the table ends up holding a mix of codecs
+CODECS = {
+    "zlib": (b"z", lambda data: zlib.compress(data, 6), zlib.decompress),
+    "lzma": (b"x", lzma.compress, lzma.decompress),
+}
+DECODERS = {marker: decompress for marker, _, decompress in CODECS.values()}
+
+
+def threshold():
+    return getattr(settings, "MAIL_BODY_COMPRESSION_THRESHOLD", DEFAULT_THRESHOLD)
+
+
+def compress_body(text, codec=None):
+    # Returns a (body, body_compressed) pair ready to be put on an Email.  Below the threshold the text
+    # is returned untouched with no blob; above it the text column keeps only the preview and the blob
+    # carries the marker byte followed by the compressed utf-8 bytes
+    if text is None or len(text) <= threshold():
+        return text, None
+    codec = codec or getattr(settings, "MAIL_BODY_CODEC", "zlib")
+    try:
+        marker, compress, _ = CODECS[codec]
+    except KeyError:
+        raise ValueError(f"Unknown body codec {codec!r}.")
+    return text[:PREVIEW_LENGTH], marker + compress(text.encode("utf-8"))
+
+
+def decompress_body(blob):
+    blob = bytes(blob)
+    try:
+        decompress = DECODERS[blob[:1]]
+    except KeyError:
+        raise ValueError(f"Unknown body codec marker {blob[:1]!r}.")
+    return decompress(blob[1:]).decode("utf-8")
+
+
+def compress_existing(queryset, batch_size=500):
+    # Compresses every already-stored row in queryset whose plain text body is over the threshold, for
+    # the compress_bodies command.  Returns (rows compressed, bytes before, bytes after)
+    pks = list(
+        queryset.annotate(body_length=Length("body"))
+        .filter(body_length__gt=threshold())
+        .values_list("pk", flat=True)
+    )
+    manager = queryset.model._default_manager
+    before = after = 0
+    for start in range(0, len(pks), batch_size):
+        batch = list(manager.filter(pk__in=pks[start:start + batch_size]).only("pk", "body"))
+        for email in batch:
+            text = email.body
+            email.body, email.body_compressed = compress_body(text)
+            before += len(text.encode("utf-8"))
+            after += len(email.body_compressed)
+        manager.bulk_update(batch, ["body", "body_compressed"])
+    return len(pks), before, after
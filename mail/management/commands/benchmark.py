@@ -0,0 +1,179 @@
+import time
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.http import JsonResponse
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment
+)
+from django.urls import reverse
+
+from mail import columnar, compression
+from mail.autocomplete import index
+from mail.models import Email, User
+
+
+def timed(func, repeat):
+    # Average wall time of one call in milliseconds
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def sample_bodies():
+    # Roughly what the large rows look like in practice: a reply chain that quotes itself over and over,
+    # and a pasted log
+    reply = "Thanks, that works for me. Let's pick this up again on Monday.\n"
+    chain = ""
+    for depth in range(40):
+        chain = f"On Jan {depth + 1} 2025, someone{depth}@example.com wrote:\n" + reply + "> " + chain
+    log = "".join(
+        f"2025-01-31 06:{i // 60:02d}:{i % 60:02d} INFO worker-{i % 8} processed job {i} in {i % 97}ms\n"
+        for i in range(3000)
+    )
+    return {"reply chain": chain, "pasted log": log}
+
+
+def listing_rows(emails):
+    # The fields columnar.encode sends, as the usual one dict per email with full addresses and formatted
+    # timestamps, read with the same number of queries
+    return [
+        {
+            "id": email.id,
+            "sender": email.sender.email,
+            "recipients": [user.email for user in email.recipients.all()],
+            "subject": email.subject,
+            "timestamp": email.timestamp.strftime("%b %d %Y, %I:%M %p"),
+            "read": email.read,
+            "archived": email.archived,
+            "thread_id": str(email.thread_id),
+        }
+        for email in emails.select_related("sender").prefetch_related("recipients").only(
+            "id", "sender__email", "subject", "timestamp", "read", "archived", "thread_id"
+        )
+    ]
+
+
+@contextmanager
+def test_database():
+    # Scenarios that need rows run against a throwaway test database, never the real one
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def populate_mailbox(rows):
+    # One user with an inbox of rows emails from a handful of senders, each also sent to a few others
+    users = [
+        User.objects.create_user(username=f"user{i}@example.com", email=f"user{i}@example.com", password="x")
+        for i in range(10)
+    ]
+    owner = users[0]
+    for i in range(rows):
+        email = Email.objects.create(
+            user=owner, sender=users[1 + i % 9], subject=f"Status update {i}", body="See the notes below.\n" * 20
+        )
+        email.recipients.add(owner, *users[1 + (i + 1) % 9:1 + (i + 1) % 9 + 3])
+    return owner
+
+
+class Command(BaseCommand):
+    help = "Print storage and latency numbers for the mail app's hot paths."
+
+    def add_arguments(self, parser):
+        parser.add_argument("scenario", choices=["auth", "autocomplete", "compression", "mailbox"])
+        parser.add_argument("--repeat", type=int, default=200)
+        parser.add_argument("--rows", type=int, default=500)
+
+    def handle(self, *args, **options):
+        getattr(self, f"bench_{options['scenario']}")(options)
+
+    def bench_compression(self, options):
+        repeat = options["repeat"]
+        for name, text in sample_bodies().items():
+            raw = len(text.encode("utf-8"))
+            self.stdout.write(f"{name}: {raw} bytes raw")
+            for codec in compression.CODECS:
+                _, blob = compression.compress_body(text, codec=codec)
+                if blob is None:
+                    self.stdout.write(f"  {codec}: under threshold, stored as plain text")
+                    continue
+                compress_ms = timed(lambda: compression.compress_body(text, codec=codec), repeat)
+                # A fresh instance every call so the per-instance cache doesn't hide the decompress
+                read_ms = timed(lambda: Email(body="", body_compressed=blob).get_body(), repeat)
+                self.stdout.write(
+                    f"  {codec}: {len(blob)} bytes stored ({len(blob) / raw:.1%}), "
+                    f"compress {compress_ms:.3f} ms, get_body {read_ms:.3f} ms"
+                )
+
+    def bench_mailbox(self, options):
+        # The view's two formats differ in more than layout, since the JSON list also carries bodies and
+        # attachments.  The "listing" pair encodes exactly the same fields from the same rows both ways,
+        # so it measures only what the columnar layout itself saves
+        repeat = max(options["repeat"] // 20, 1)
+        rows = options["rows"]
+        with test_database():
+            owner = populate_mailbox(rows)
+            client = Client()
+            client.force_login(owner)
+            url = reverse("mailbox", kwargs={"mailbox": "inbox"})
+            emails = Email.objects.filter(user=owner, recipients=owner, archived=False).order_by("-timestamp")
+            encoders = [
+                ("view, json", lambda: client.get(url, headers={"Accept": "application/json"})),
+                ("view, columns", lambda: client.get(url, headers={"Accept": columnar.CONTENT_TYPE})),
+                ("listing, json", lambda: JsonResponse(listing_rows(emails), safe=False)),
+                ("listing, columns", lambda: JsonResponse(columnar.encode(emails))),
+            ]
+            for name, encode in encoders:
+                size = len(encode().content)
+                ms = timed(encode, repeat)
+                self.stdout.write(
+                    f"{name}: {size} bytes for {rows} rows, {ms:.2f} ms ({ms * 1000 / rows:.1f} us per row)"
+                )
+
+    def bench_autocomplete(self, options):
+        with test_database():
+            owner = populate_mailbox(options["rows"])
+            User.objects.bulk_create(
+                User(username=f"member{i}@example.com", email=f"member{i}@example.com") for i in range(100000)
+            )
+            build_ms = timed(index.build, 1)
+            self.stdout.write(f"build: {len(index.keys)} addresses in {build_ms:.1f} ms")
+            for prefix in ["u", "user1", "member", "member999", "nobody"]:
+                ms = timed(lambda: index.complete(owner.id, prefix), options["repeat"])
+                self.stdout.write(f"prefix {prefix!r}: {ms * 1000:.1f} us per lookup")
+
+    def bench_auth(self, options):
+        modes = [
+            ("database", {
+                "SESSION_ENGINE": "django.contrib.sessions.backends.db",
+                "AUTHENTICATION_BACKENDS": ["django.contrib.auth.backends.ModelBackend"],
+            }),
+            ("cached", {
+                "SESSION_ENGINE": "django.contrib.sessions.backends.cached_db",
+                "AUTHENTICATION_BACKENDS": ["mail.backends.CachedModelBackend"],
+            }),
+        ]
+        with test_database():
+            owner = populate_mailbox(1)
+            email = Email.objects.get(user=owner)
+            url = reverse("email", kwargs={"email_id": email.id})
+            for name, overrides in modes:
+                with override_settings(**overrides):
+                    client = Client()
+                    client.force_login(owner)
+                    put = lambda: client.put(url, data='{"read": true}', content_type="application/json")
+                    put()
+                    with CaptureQueriesContext(connection) as queries:
+                        put()
+                    # counted before timing, the query log is a bounded deque that timed() would roll over
+                    count = len(queries)
+                    ms = timed(put, options["repeat"])
+                    self.stdout.write(f"{name}: {count} queries, {ms:.2f} ms per PUT")
@@ -0,0 +1,57 @@
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError
+from django.db.models import ProtectedError
+from django.utils import timezone
+
+from mail import attachments
+from mail.models import Blob, Upload
+
+
+class Command(BaseCommand):
+    help = "Remove abandoned uploads and attachment files no email or upload uses any more."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=int, default=getattr(settings, "MAIL_UPLOAD_MAX_AGE_HOURS", 24),
+                            help="Uploads older than this many hours that were never sent are removed.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options["hours"])
+
+        # uploads that were started but never finished, or finished but never attached to an email
+        stale = list(Upload.objects.filter(created__lt=cutoff).values_list("pk", flat=True))
+        for upload_id in stale:
+            attachments.discard_upload(upload_id)
+        Upload.objects.filter(pk__in=stale).delete()
+
+        # partial files left behind without a row, e.g. by a chunk that arrived after its upload finished
+        uploads_dir = os.path.join(attachments.root(), "uploads")
+        live = {str(pk) for pk in Upload.objects.values_list("pk", flat=True)}
+        orphans = 0
+        if os.path.isdir(uploads_dir):
+            for name in os.listdir(uploads_dir):
+                path = os.path.join(uploads_dir, name)
+                if name not in live and os.path.getmtime(path) < cutoff.timestamp():
+                    os.remove(path)
+                    orphans += 1
+
+        # blobs nothing points at any more.  Each one is deleted on its own, so a blob that gets attached
+        # to a new email in the meantime is protected by the foreign key and simply skipped
+        blobs = 0
+        for sha256 in Blob.objects.filter(attachments__isnull=True, upload__isnull=True).values_list(
+            "sha256", flat=True
+        ):
+            try:
+                Blob.objects.filter(pk=sha256, attachments__isnull=True, upload__isnull=True).delete()
+            except (IntegrityError, ProtectedError):
+                continue
+            try:
+                os.remove(attachments.blob_path(sha256))
+            except FileNotFoundError:
+                pass
+            blobs += 1
+
+        self.stdout.write(f"Removed {len(stale)} stale uploads, {orphans} orphaned partial files and {blobs} unused blobs.")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from mail.compression import compress_existing
+from mail.models import Email
+
+
+class Command(BaseCommand):
+    help = "Compress stored email bodies that are over MAIL_BODY_COMPRESSION_THRESHOLD."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        rows, before, after = compress_existing(Email.objects.all(), batch_size=options["batch_size"])
+        self.stdout.write(f"Compressed {rows} bodies: {before} bytes -> {after} bytes.")
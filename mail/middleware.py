@@ -0,0 +1,113 @@
+import gzip
+import mimetypes
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Hashed static files never change under the same name, so they can be cached for a year
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Anything requested by its plain name might change on the next deploy
+DEFAULT_CACHE_CONTROL = "public, max-age=60"
+
+
+def accepted_encodings(request):
+    # The content codings the client is willing to take, ignoring any it explicitly refuses with q=0
+    accepted = set()
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip().partition("=")[2] if params.strip().startswith("q=") else "1"
+        try:
+            if float(q) > 0:
+                accepted.add(coding.strip().lower())
+        except ValueError:
+            pass
+    return accepted
+
+
+class StaticFilesMiddleware:
+    # Serves files from STATIC_ROOT (filled by collectstatic, see storage.py) without going through the
+    # URLconf or any view.  Picks the precompressed .br or .gz copy when the client accepts it, and marks
+    # content-hashed names as immutable.  Anything not found in STATIC_ROOT falls through, so runserver
+    # still serves straight from the app directories before collectstatic has been run
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL
+        self.root = settings.STATIC_ROOT
+        self.immutable = set(getattr(staticfiles_storage, "hashed_files", {}).values())
+
+    def __call__(self, request):
+        if self.root and request.method in ("GET", "HEAD") and request.path.startswith(self.prefix):
+            response = self.serve(request, request.path[len(self.prefix):])
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    def serve(self, request, name):
+        try:
+            path = safe_join(self.root, name)
+        except SuspiciousFileOperation:
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        accepted = accepted_encodings(request)
+        encoding = None
+        for coding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if coding in accepted and os.path.isfile(path + suffix):
+                path, encoding = path + suffix, coding
+                break
+
+        response = FileResponse(open(path, "rb"), content_type=content_type)
+        if encoding:
+            response["Content-Encoding"] = encoding
+        response["Cache-Control"] = IMMUTABLE_CACHE_CONTROL if name in self.immutable else DEFAULT_CACHE_CONTROL
+        patch_vary_headers(response, ["Accept-Encoding"])
+        return response
+
+
+class CompressionMiddleware:
+    # Compresses JSON API responses larger than MAIL_COMPRESS_MIN_SIZE bytes, with brotli when the client
+    # accepts it and the brotli package is installed, otherwise gzip.  Smaller responses aren't worth the
+    # CPU.  Only JSON is touched, so pages carrying a CSRF token are never compressed (BREACH)
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = getattr(settings, "MAIL_COMPRESS_MIN_SIZE", 1024)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        content_type = response.get("Content-Type", "").split(";")[0]
+        if response.streaming or response.has_header("Content-Encoding") or not content_type.endswith("json"):
+            return response
+
+        patch_vary_headers(response, ["Accept-Encoding"])
+        if len(response.content) < self.min_size:
+            return response
+
+        accepted = accepted_encodings(request)
+        if brotli is not None and "br" in accepted:
+            encoding, compressed = "br", brotli.compress(response.content, quality=5)
+        elif "gzip" in accepted:
+            encoding, compressed = "gzip", gzip.compress(response.content, compresslevel=6, mtime=0)
+        else:
+            return response
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response["Content-Length"] = str(len(compressed))
+        response["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mail', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='email',
+            name='body_compressed',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+import zlib
+
+from django.db import migrations
+from django.db.models.functions import Length
+
+
+# Frozen copies of what mail/compression.py did when this migration was written, so replaying it later
+# gives the same rows whatever that module or the settings have become since: bodies over 4096
+# characters are stored as the zlib marker byte followed by zlib level 6 data
+THRESHOLD = 4096
+ZLIB_MARKER = b"z"
+BATCH_SIZE = 500
+
+
+def compress_bodies(apps, schema_editor):
+    Email = apps.get_model("mail", "Email")
+    pks = list(
+        Email.objects.annotate(body_length=Length("body"))
+        .filter(body_length__gt=THRESHOLD)
+        .values_list("pk", flat=True)
+    )
+    for start in range(0, len(pks), BATCH_SIZE):
+        batch = list(Email.objects.filter(pk__in=pks[start:start + BATCH_SIZE]).only("pk", "body"))
+        for email in batch:
+            email.body_compressed = ZLIB_MARKER + zlib.compress(email.body.encode("utf-8"), 6)
+            email.body = ""
+        Email.objects.bulk_update(batch, ["body", "body_compressed"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mail', '0002_email_body_compressed'),
+    ]
+
+    operations = [
+        migrations.RunPython(compress_bodies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:31
+
+import uuid
+from django.db import migrations, models
+
+
+def start_threads(apps, schema_editor):
+    # AddField evaluates uuid.uuid4 once, which would put every existing email in the same thread.
+    # Older emails have nothing linking their replies together, so each one starts its own thread
+    Email = apps.get_model("mail", "Email")
+    emails = list(Email.objects.only("pk"))
+    for email in emails:
+        email.thread_id = uuid.uuid4()
+    Email.objects.bulk_update(emails, ["thread_id"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mail', '0004_attachments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='email',
+            name='thread_id',
+            field=models.UUIDField(null=True),
+        ),
+        migrations.RunPython(start_threads, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='email',
+            name='thread_id',
+            field=models.UUIDField(default=uuid.uuid4),
+        ),
+        migrations.AddIndex(
+            model_name='email',
+            index=models.Index(fields=['user', 'thread_id', 'timestamp'], name='mail_email_thread_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mail', '0005_email_thread_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='email',
+            index=models.Index(fields=['read', 'id'], name='mail_email_read_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='email',
+            index=models.Index(fields=['archived', 'id'], name='mail_email_archived_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='email',
+            index=models.Index(fields=['timestamp'], name='mail_email_timestamp_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+import lzma
+import zlib
+
+from django.db import migrations
+
+
+# Frozen copies of the codec markers and preview length in mail/compression.py when this migration was
+# written, so replaying it later gives the same rows
+DECODERS = {b"z": zlib.decompress, b"x": lzma.decompress}
+PREVIEW_LENGTH = 80
+BATCH_SIZE = 500
+
+
+def add_previews(apps, schema_editor):
+    # Rows compressed before previews existed have an empty body column.  Give each the first characters
+    # of its decoded body, as compress_body now does for new rows
+    Email = apps.get_model("mail", "Email")
+    pks = list(Email.objects.filter(body_compressed__isnull=False, body="").values_list("pk", flat=True))
+    for start in range(0, len(pks), BATCH_SIZE):
+        batch = list(Email.objects.filter(pk__in=pks[start:start + BATCH_SIZE]).only("pk", "body_compressed"))
+        for email in batch:
+            blob = bytes(email.body_compressed)
+            email.body = DECODERS[blob[:1]](blob[1:]).decode("utf-8")[:PREVIEW_LENGTH]
+        Email.objects.bulk_update(batch, ["body"])
+
+
+def remove_previews(apps, schema_editor):
+    Email = apps.get_model("mail", "Email")
+    Email.objects.filter(body_compressed__isnull=False).update(body="")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mail', '0006_email_admin_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_previews, remove_previews),
+    ]
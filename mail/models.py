@@ -1,6 +1,10 @@
+import uuid
+
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+from .compression import compress_body, decompress_body
+
 
 class User(AbstractUser):
     pass
@@ -12,9 +16,42 @@ class Email(models.Model):
     recipients = models.ManyToManyField("User", related_name="emails_received")
     subject = models.CharField(max_length=255)
     body = models.TextField(blank=True)
+    # Large bodies live here, compressed and prefixed with a codec marker, while body keeps only their
+    # first characters as a preview (see compression.py).  Only ever decoded when get_body() is called
+    body_compressed = models.BinaryField(null=True, blank=True, editable=False)
     timestamp = models.DateTimeField(auto_now_add=True)
     read = models.BooleanField(default=False)
     archived = models.BooleanField(default=False)
+    # Shared by every message in a conversation, and by every fan-out copy of each message.  compose
+    # copies it from the email being replied to, or starts a new thread
+    thread_id = models.UUIDField(default=uuid.uuid4)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "thread_id", "timestamp"], name="mail_email_thread_idx"),
+            # the admin changelist filters (see admin.py), each ending in id so a filtered page is still an
+            # index range scan in the newest-first order
+            models.Index(fields=["read", "id"], name="mail_email_read_idx"),
+            models.Index(fields=["archived", "id"], name="mail_email_archived_idx"),
+            models.Index(fields=["timestamp"], name="mail_email_timestamp_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Catch any oversized body that was assigned directly instead of going through compress_body
+        # (compose compresses once up front so the fan-out copies don't each pay for it).  Once there is
+        # a blob, body is just its preview, so replacing a compressed body means clearing body_compressed
+        if self.body and self.body_compressed is None:
+            text = self.body
+            self.body, self.body_compressed = compress_body(text)
+            self._body_cache = text if self.body_compressed is not None else None
+        super().save(*args, **kwargs)
+
+    def get_body(self):
+        if self.body_compressed is None:
+            return self.body
+        if getattr(self, "_body_cache", None) is None:
+            self._body_cache = decompress_body(self.body_compressed)
+        return self._body_cache
 
     def serialize(self):
         return {
@@ -22,8 +59,56 @@ class Email(models.Model):
             "sender": self.sender.email,
             "recipients": [user.email for user in self.recipients.all()],
             "subject": self.subject,
-            "body": self.body,
+            "body": self.get_body(),
             "timestamp": self.timestamp.strftime("%b %d %Y, %I:%M %p"),
             "read": self.read,
-            "archived": self.archived
+            "archived": self.archived,
+            "thread_id": str(self.thread_id),
+            # metadata only, the file itself is fetched from the attachment download route
+            "attachments": [attachment.serialize() for attachment in self.attachments.all()]
+        }
+
+
+class Blob(models.Model):
+    # One row per distinct file on disk, keyed by the sha256 of its contents (see attachments.blob_path)
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+
+
+class Upload(models.Model):
+    # A resumable upload in progress.  Chunks are appended to a partial file until received == size,
+    # then the file moves into the blob store and blob is set
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey("User", on_delete=models.CASCADE, related_name="uploads")
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    blob = models.ForeignKey("Blob", on_delete=models.PROTECT, null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def serialize(self):
+        return {
+            "id": str(self.id),
+            "filename": self.filename,
+            "size": self.size,
+            "offset": self.received,
+            "complete": self.blob_id is not None
+        }
+
+
+class Attachment(models.Model):
+    # Each fan-out copy of an email gets its own Attachment rows, but they all point at the same Blob
+    email = models.ForeignKey("Email", on_delete=models.CASCADE, related_name="attachments")
+    blob = models.ForeignKey("Blob", on_delete=models.PROTECT, related_name="attachments")
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "content_type": self.content_type,
+            "size": self.size
         }
@@ -15,6 +15,75 @@ function getCookie(name) {
 
 const csrftoken = getCookie('csrftoken');
 
+// attachments are uploaded in slices of this many bytes, so a dropped connection only costs one slice
+const CHUNK_SIZE = 1024 * 1024;
+
+function uploadFile(file) {
+  // start a resumable upload on the server, then send the file one slice at a time.  Resolves to the
+  // upload id that compose needs to attach the file
+  return fetch('/uploads', {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      'X-CSRFToken': csrftoken,
+    },
+    body: JSON.stringify({
+      filename: file.name,
+      content_type: file.type,
+      size: file.size
+    })
+  })
+  .then(response => response.json())
+  .then(upload => {
+    if (upload.error) {
+      throw new Error(upload.error);
+    }
+    return sendChunks(file, upload, 3);
+  });
+}
+
+function sendChunks(file, upload, retries) {
+  if (upload.complete) {
+    return Promise.resolve(upload.id);
+  }
+  const start = upload.offset;
+  const end = Math.min(start + CHUNK_SIZE, file.size) - 1;
+  return fetch(`/uploads/${upload.id}`, {
+    method: 'PUT',
+    headers: {
+      'Content-Type': 'application/octet-stream',
+      'Content-Range': `bytes ${start}-${end}/${file.size}`,
+      'X-CSRFToken': csrftoken,
+    },
+    body: file.slice(start, end + 1)
+  })
+  .then(response => response.ok ? response.json() : null, () => null)
+  .then(next => {
+    if (next) {
+      return sendChunks(file, next, retries);
+    }
+    if (retries === 0) {
+      throw new Error(`Upload of ${file.name} failed.`);
+    }
+    // the chunk failed, so ask the server how much of the file it actually has and resume from there
+    return fetch(`/uploads/${upload.id}`)
+      .then(response => response.json())
+      .then(status => sendChunks(file, status, retries - 1));
+  });
+}
+
+function createAttachmentsDiv(emailId, attachments) {
+  const attachmentsDiv = document.createElement("div");
+  attachments.forEach(attachment => {
+    const link = document.createElement("a");
+    link.href = `/emails/${emailId}/attachments/${attachment.id}`;
+    link.textContent = `${attachment.filename} (${Math.ceil(attachment.size / 1024)} KB)`;
+    attachmentsDiv.appendChild(link);
+    attachmentsDiv.appendChild(document.createElement("br"));
+  });
+  return attachmentsDiv;
+}
+
 function createReadToggleButton(emailId, readStatus, mailbox){
   const button = document.createElement('button');
   button.classList.add("btn", "btn-sm", "btn-outline-secondary");
@@ -66,7 +135,63 @@ function createArchiveToggleButton(emailId, isArchived, mailbox){
   return button;
 }
 
-function createEmailDiv(emailId, sender, subject, timestamp, isRead, isArchived, mailbox) {
+// mailbox listings are requested in the compact format, with one array per field instead of one object
+// per email (see mail/columnar.py)
+const COLUMNS_CONTENT_TYPE = 'application/vnd.mail.columns+json';
+const MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'];
+
+function formatTimestamp(seconds) {
+  // epoch seconds -> "Jan 31 2025, 06:02 AM", the same UTC format the server uses for single emails
+  const date = new Date(seconds * 1000);
+  const pad = number => String(number).padStart(2, '0');
+  const hours = date.getUTCHours();
+  return `${MONTHS[date.getUTCMonth()]} ${pad(date.getUTCDate())} ${date.getUTCFullYear()}, ` +
+    `${pad(hours % 12 || 12)}:${pad(date.getUTCMinutes())} ${hours < 12 ? 'AM' : 'PM'}`;
+}
+
+function decodeColumns(data) {
+  // turn the parallel arrays back into the list of email objects the rest of this file expects
+  const columns = data.columns;
+  const emails = [];
+  for (let i = 0; i < data.count; i++) {
+    emails.push({
+      id: columns.id[i],
+      sender: data.addresses[columns.sender[i]],
+      recipients: columns.recipients[i].map(index => data.addresses[index]),
+      subject: columns.subject[i],
+      timestamp: formatTimestamp(columns.timestamp[i]),
+      read: columns.read[i],
+      archived: columns.archived[i],
+      thread_id: columns.thread_id[i],
+      thread_count: columns.thread_count ? columns.thread_count[i] : 1
+    });
+  }
+  return emails;
+}
+
+function createThreadDiv(emailId, thread, mailbox) {
+  const threadDiv = document.createElement("div");
+  threadDiv.innerHTML = `<strong>Conversation (${thread.length}):</strong>`;
+  thread.forEach(message => {
+    const messageDiv = document.createElement("div");
+    // sender and subject are set as text, never parsed as HTML
+    if (message.id === emailId) {
+      const current = document.createElement("strong");
+      current.textContent = `${message.timestamp} - ${message.sender}: ${message.subject}`;
+      messageDiv.appendChild(current);
+    } else {
+      const link = document.createElement("a");
+      link.href = "#";
+      link.textContent = `${message.timestamp} - ${message.sender}: ${message.subject}`;
+      link.onclick = () => get_email(message.id, mailbox);
+      messageDiv.appendChild(link);
+    }
+    threadDiv.appendChild(messageDiv);
+  });
+  return threadDiv;
+}
+
+function createEmailDiv(emailId, sender, subject, timestamp, isRead, isArchived, mailbox, threadCount) {
   const emailDiv = document.createElement("div");
   emailDiv.style.border = "1px solid black"; 
   emailDiv.style.padding = "10px"; 
@@ -77,7 +202,7 @@ function createEmailDiv(emailId, sender, subject, timestamp, isRead, isArchived,
   emailDiv.innerHTML = `
     <a href="#" class="email-link" data-email-id="${emailId}" data-mailbox="${mailbox}">
       <strong>Sender:</strong> ${sender} <br>
-      <strong>Subject:</strong> ${subject} <br>
+      <strong>Subject:</strong> ${subject} ${threadCount > 1 ? `(${threadCount})` : ""} <br>
       <strong>Timestamp:</strong> ${timestamp}
     </a>
     `;
@@ -110,6 +235,7 @@ document.addEventListener('DOMContentLoaded', function() {
   document.querySelector('#sent').addEventListener('click', () => load_mailbox('sent'));
   document.querySelector('#archived').addEventListener('click', () => load_mailbox('archive'));
   document.querySelector('#compose').addEventListener('click', compose_email);
+  document.querySelector('#compose-recipients').addEventListener('input', suggest_recipients);
   document.querySelector('#emails-view').addEventListener('click', function(event) {
     if (event.target.classList.contains('email-link')) {
       const emailId = event.target.getAttribute('data-email-id');
@@ -173,9 +299,10 @@ function get_email(emailId, mailbox) { // dynamically render individual emails w
     // Add event handler to the button so when it's clicked, emails-view and individual-email-views are
     // hidden and compose-view is shown to allow user to compose a reply
     replyButton.onclick = function() {
-      document.querySelector('#emails-view').style.display = 'none';
-      document.querySelector('#individual-email-view').style.display = 'none';
-      document.querySelector('#compose-view').style.display = 'block';
+      // compose_email shows the compose-view, hides the others and hooks up the form submission
+      compose_email();
+      // remember which email this answers, so the server puts the reply in the same thread
+      document.querySelector('#compose-form').dataset.inReplyTo = emailId;
       // autopopulate the recipients field with the sender of the eamil.  Note that we do not have to
       // autopopulate the sender field, since our view function does that.  Then autopoplulate the subject
       // field with the subject of the original email, prepending with "Re:" note that we're still within
@@ -258,9 +385,52 @@ function get_email(emailId, mailbox) { // dynamically render individual emails w
     emailView.appendChild(archiveButton);
     emailView.appendChild(hrTag);
     emailView.appendChild(bodyDiv);
+    if (emailData.attachments.length > 0) {
+      emailView.appendChild(document.createElement("hr"));
+      emailView.appendChild(createAttachmentsDiv(emailId, emailData.attachments));
+    }
+    // show the rest of the conversation underneath, if there is any
+    fetch(`/threads/${emailData.thread_id}`)
+    .then(response => response.json())
+    .then(thread => {
+      if (thread.length > 1) {
+        emailView.appendChild(document.createElement("hr"));
+        emailView.appendChild(createThreadDiv(emailData.id, thread, mailbox));
+      }
+    });
+  });
+}
+
+function suggest_recipients(event) {
+  // the To field holds several comma separated addresses, so only the one being typed (after the last
+  // comma) is sent as the prefix.  Each suggestion keeps the addresses already typed in front of it
+  const value = event.target.value;
+  const lastComma = value.lastIndexOf(',');
+  const typed = lastComma === -1 ? '' : value.slice(0, lastComma + 1) + ' ';
+  const prefix = value.slice(lastComma + 1).trim();
+  const datalist = document.querySelector('#compose-suggestions');
+  if (prefix === '') {
+    datalist.innerHTML = '';
+    return;
+  }
+  fetch(`/emails/autocomplete?prefix=${encodeURIComponent(prefix)}`)
+  .then(response => response.json())
+  .then(addresses => {
+    datalist.innerHTML = '';
+    addresses.forEach(address => {
+      const option = document.createElement('option');
+      option.value = typed + address;
+      datalist.appendChild(option);
+    });
   });
 }
 
+function showComposeError(message) {
+  const errorDiv = document.querySelector('#compose-error');
+  errorDiv.textContent = message;
+  errorDiv.style.display = message ? 'block' : 'none';
+}
+
 function compose_email() {
   document.querySelector('#compose-form').onsubmit = function(event) {
     event.preventDefault();
@@ -268,28 +438,38 @@ function compose_email() {
     let data = {
       recipients: event.target.querySelector('#compose-recipients').value,
       subject: event.target.querySelector('#compose-subject').value,
-      body: event.target.querySelector('#compose-body').value
+      body: event.target.querySelector('#compose-body').value,
+      in_reply_to: event.target.dataset.inReplyTo
     };
-    // convert data (in dict form) to a byte string to send to server
-    const jsonData = JSON.stringify(data);
-    // send an AJAX request of POST method to the server, including the byte string in the body of the 
-    // request
-    fetch('/emails', {
-      method: 'POST',
-      headers: {
-          'Content-Type': 'application/json',
-          'X-CSRFToken': csrftoken,
-      },
-      body: jsonData, 
+    // upload any chosen files first, then send the email with just the ids of the finished uploads
+    const files = Array.from(event.target.querySelector('#compose-attachments').files);
+    Promise.all(files.map(uploadFile))
+    .then(uploadIds => {
+      data.attachments = uploadIds;
+      // convert data (in dict form) to a byte string to send to server
+      const jsonData = JSON.stringify(data);
+      // send an AJAX request of POST method to the server, including the byte string in the body of the 
+      // request
+      return fetch('/emails', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': csrftoken,
+        },
+        body: jsonData, 
+      });
     })
     // get a resonse back, convert to a JS object and call it data
     .then(response => response.json())
     .then(data => {
-      if (!data.error) {
-        // if data was returned, call load_mailbox to show sent emails
-        load_mailbox('sent');
+      if (data.error) {
+        throw new Error(data.error);
       }
-    });
+      // if data was returned, call load_mailbox to show sent emails
+      load_mailbox('sent');
+    })
+    // a failed upload or a rejected email both end up here, and stay on the form so nothing typed is lost
+    .catch(error => showComposeError(error.message));
   }
 
   // Show compose view and hide other views
@@ -298,9 +478,12 @@ function compose_email() {
   document.querySelector('#individual-email-view').style.display = 'none';
 
   // Clear out composition fields
+  showComposeError('');
   document.querySelector('#compose-recipients').value = '';
   document.querySelector('#compose-subject').value = '';
   document.querySelector('#compose-body').value = '';
+  document.querySelector('#compose-attachments').value = '';
+  delete document.querySelector('#compose-form').dataset.inReplyTo;
 }
 
 function load_mailbox(mailbox) {
@@ -319,11 +502,14 @@ function load_mailbox(mailbox) {
   // path("emails/<str:mailbox>", views.mailbox, name="mailbox"),  the fetch will add mailbox dynamically
   // as either inbox, sent, or archive based on the event handlers above for the 3 buttons by setting
   // mailbox to either of these 3 values, then calling load_mailbox function of the chosen variable
-  fetch(`/emails/${mailbox}`)
-  // response.json will take the array of dicts returned by view function and convert it to a js array
-  // and store it temporarily as response(promise), then the next line names "emails" as what that js 
-  // arrary will be named from here on out
+  // group=thread collapses each conversation to its newest email plus a count
+  fetch(`/emails/${mailbox}?group=thread`, {
+    headers: { 'Accept': COLUMNS_CONTENT_TYPE }
+  })
+  // response.json will take the columns returned by view function and convert them to a js object,
+  // then decodeColumns rebuilds the array of emails, which the next line names "emails" from here on out
   .then(response => response.json())
+  .then(decodeColumns)
   .then(emails => {
     // loop through each dict in the array and call the following arrow function - could also be an 
     // anonymous function here too, as emails.forEach(function(email) {.....})
@@ -335,7 +521,8 @@ function load_mailbox(mailbox) {
           email.timestamp,    // timestamp
           email.read,         // isRead
           email.archived,     // isArchived
-          mailbox             // pass the mailbox type (inbox, sent, archive)
+          mailbox,            // pass the mailbox type (inbox, sent, archive)
+          email.thread_count  // threadCount
         );
       
       emailsView.appendChild(emailDiv)
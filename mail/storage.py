@@ -0,0 +1,50 @@
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Text formats worth compressing.  Images and fonts are already compressed
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".map", ".html", ".json", ".svg", ".txt", ".xml"}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    # collectstatic writes each file under a content-hashed name (styles.css -> styles.3f2a9c1b7d4e.css)
+    # as usual, then stores a .gz and, when the brotli package is installed, a .br copy next to every
+    # text file.  StaticFilesMiddleware serves whichever of these the client accepts
+
+    def stored_name(self, name):
+        # Before collectstatic has written a manifest (runserver, the test suite) there are no hashed
+        # copies to point at, so {% static %} falls back to the plain name
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        for name in set(self.hashed_files) | set(self.hashed_files.values()):
+            if os.path.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS:
+                self.write_compressed(name)
+
+    def write_compressed(self, name):
+        # Only kept when the result is actually smaller than the original.  A leftover variant from an
+        # earlier collectstatic is removed rather than served with the wrong contents
+        path = self.path(name)
+        with open(path, "rb") as f:
+            data = f.read()
+        variants = [(".gz", gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append((".br", brotli.compress(data, quality=11)))
+        for suffix, compressed in variants:
+            if len(compressed) < len(data):
+                with open(path + suffix, "wb") as f:
+                    f.write(compressed)
+            elif os.path.exists(path + suffix):
+                os.remove(path + suffix)
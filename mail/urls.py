@@ -10,6 +10,11 @@ urlpatterns = [
 
     # API Routes - need to add fetch("/emails, ......") to the js to get to these?
     path("emails", views.compose, name="compose"),
+    path("emails/autocomplete", views.autocomplete, name="autocomplete"),
     path("emails/<int:email_id>", views.email, name="email"),
+    path("emails/<int:email_id>/attachments/<int:attachment_id>", views.attachment, name="attachment"),
+    path("threads/<uuid:thread_id>", views.thread, name="thread"),
+    path("uploads", views.upload, name="upload"),
+    path("uploads/<uuid:upload_id>", views.upload_chunk, name="upload_chunk"),
     path("emails/<str:mailbox>", views.mailbox, name="mailbox"),
 ]
@@ -1,12 +1,21 @@
 import json
+import uuid
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
+from django.core.exceptions import ValidationError
 from django.db import IntegrityError
-from django.http import JsonResponse
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+from django.http import FileResponse, JsonResponse
 from django.shortcuts import HttpResponse, HttpResponseRedirect, render
 from django.urls import reverse
+from django.utils.cache import patch_vary_headers
 
-from .models import User, Email
+from . import attachments, columnar
+from .autocomplete import index as recipient_index
+from .compression import compress_body
+from .models import Attachment, Blob, Email, Upload, User
 
 
 def index(request):
@@ -72,6 +81,38 @@ def compose(request):
     subject = data.get("subject", "")
     body = data.get("body", "")
 
+    # Attachments arrive as the ids of finished uploads (see upload_chunk below), never as file data
+    upload_ids = data.get("attachments", [])
+    if not isinstance(upload_ids, list) or not all(isinstance(upload_id, str) for upload_id in upload_ids):
+        return JsonResponse({
+            "error": "Attachments must be a list of upload ids."
+        }, status=400)
+    upload_ids = set(upload_ids)
+    try:
+        uploads = list(Upload.objects.filter(user=request.user, pk__in=upload_ids, blob__isnull=False))
+    except ValidationError:
+        uploads = []
+    if len(uploads) != len(upload_ids):
+        return JsonResponse({
+            "error": "Attachment upload not found or not complete."
+        }, status=400)
+    # Large bodies get compressed exactly once here rather than once per copy in the loop below.  Every
+    # copy then shares the same compressed blob (or the plain text, for short bodies)
+    body, body_compressed = compress_body(body)
+
+    # A reply joins the thread of the email it answers (in_reply_to is the id of the sender's own copy),
+    # anything else starts a new thread.  Every copy below gets the same thread_id
+    thread_id = uuid.uuid4()
+    if data.get("in_reply_to") is not None:
+        try:
+            thread_id = Email.objects.values_list("thread_id", flat=True).get(
+                user=request.user, pk=data["in_reply_to"]
+            )
+        except (Email.DoesNotExist, TypeError, ValueError):
+            return JsonResponse({
+                "error": "Email being replied to does not exist."
+            }, status=400)
+
     # Create one email for each recipient, plus sender
     # initialize an empty set (set to ensure uniqueness of users)
     users = set()
@@ -97,6 +138,8 @@ def compose(request):
             sender=request.user,
             subject=subject,
             body=body,
+            body_compressed=body_compressed,
+            thread_id=thread_id,
             read=user == request.user
         )
         email.save()
@@ -107,6 +150,18 @@ def compose(request):
         for recipient in recipients:
             email.recipients.add(recipient)
         email.save()
+        # every copy gets its own attachment rows, but they all share the one blob on disk
+        Attachment.objects.bulk_create([
+            Attachment(email=email, blob_id=upload.blob_id, filename=upload.filename,
+                       content_type=upload.content_type, size=upload.size)
+            for upload in uploads
+        ])
+
+    # keep the autocomplete weights current without a rebuild
+    recipient_index.add_email(request.user, recipients)
+
+    # the uploads have been handed over to the attachments, so they're no longer needed
+    Upload.objects.filter(pk__in=[upload.pk for upload in uploads]).delete()
 
     return JsonResponse({"message": "Email sent successfully."}, status=201)
 
@@ -152,6 +207,123 @@ def email(request, email_id): # to display an individual email, accepting email_
         }, status=400)
 
 
+@login_required
+def upload(request):
+    # Starts a resumable upload.  The client sends {filename, content_type, size} and gets back an id to
+    # PUT chunks to at uploads/<id>
+    if request.method != "POST":
+        return JsonResponse({"error": "POST request required."}, status=400)
+
+    data = json.loads(request.body)
+    try:
+        size = int(data.get("size"))
+    except (TypeError, ValueError):
+        return JsonResponse({"error": "File size required."}, status=400)
+    max_size = getattr(settings, "MAIL_ATTACHMENT_MAX_SIZE", 25 * 1024 * 1024)
+    if size <= 0 or size > max_size:
+        return JsonResponse({"error": f"File size must be between 1 and {max_size} bytes."}, status=400)
+    # uploads nobody finishes are only removed by cleanup_attachments, so cap how many each user can
+    # have open at once
+    max_pending = getattr(settings, "MAIL_ATTACHMENT_MAX_PENDING", 10)
+    if Upload.objects.filter(user=request.user, blob__isnull=True).count() >= max_pending:
+        return JsonResponse({"error": f"At most {max_pending} unfinished uploads allowed."}, status=400)
+
+    upload = Upload.objects.create(
+        user=request.user,
+        filename=data.get("filename") or "attachment",
+        content_type=data.get("content_type") or "application/octet-stream",
+        size=size
+    )
+    return JsonResponse(upload.serialize(), status=201)
+
+@login_required
+def upload_chunk(request, upload_id):
+    # GET reports how far an upload got, so an interrupted client knows where to resume.  PUT appends
+    # one chunk, described by a "Content-Range: bytes start-end/size" header, to the partial file
+    if request.method not in ("GET", "PUT"):
+        return JsonResponse({"error": "GET or PUT request required."}, status=400)
+
+    try:
+        upload = Upload.objects.get(user=request.user, pk=upload_id)
+    except Upload.DoesNotExist:
+        return JsonResponse({"error": "Upload not found."}, status=404)
+
+    if request.method == "GET" or upload.blob_id is not None:
+        return JsonResponse(upload.serialize())
+
+    content_range = attachments.parse_content_range(request.headers.get("Content-Range"))
+    if content_range is None or content_range[2] != upload.size:
+        return JsonResponse({"error": "Valid Content-Range header required."}, status=400)
+    start, end, _ = content_range
+    # chunks must arrive in order, so anything not starting at the current offset is either a retry of a
+    # chunk we already have or a gap.  Either way tell the client where to carry on
+    if start != upload.received:
+        return JsonResponse({
+            "error": "Chunk does not start at the current offset.",
+            "offset": upload.received
+        }, status=409)
+
+    # The chunk is streamed to disk outside any transaction, so a slow client never holds a database
+    # lock.  The offset only moves if nobody else recorded a chunk in the meantime
+    length = end - start + 1
+    written = attachments.write_chunk(upload.id, request, start, length)
+    advanced = written == length and Upload.objects.filter(pk=upload.pk, received=start).update(
+        received=F("received") + written
+    )
+    if not advanced:
+        # cut the file back to whatever offset is recorded now, which keeps a concurrent winner's chunk
+        received = Upload.objects.values_list("received", flat=True).get(pk=upload.pk)
+        attachments.truncate_upload(upload.id, received)
+        if written != length:
+            return JsonResponse({"error": "Chunk length does not match Content-Range."}, status=400)
+        return JsonResponse({
+            "error": "Chunk does not start at the current offset.",
+            "offset": received
+        }, status=409)
+    upload.received = start + written
+
+    # last chunk in, so hash the file and move it into the blob store.  The same file uploaded twice
+    # ends up as one blob.  Only the request that recorded the last chunk gets here
+    if upload.received == upload.size:
+        sha256 = attachments.finish_upload(upload.id)
+        upload.blob, _ = Blob.objects.get_or_create(sha256=sha256, defaults={"size": upload.size})
+        Upload.objects.filter(pk=upload.pk).update(blob=upload.blob)
+    return JsonResponse(upload.serialize())
+
+@login_required
+def attachment(request, email_id, attachment_id):
+    # Streams an attachment straight from the blob store.  Supports single byte ranges so downloads can
+    # be resumed, and hands the open file to FileResponse so a WSGI server with sendfile support never
+    # copies the bytes through Python
+    try:
+        attachment = Attachment.objects.get(pk=attachment_id, email_id=email_id, email__user=request.user)
+    except Attachment.DoesNotExist:
+        return JsonResponse({"error": "Attachment not found."}, status=404)
+
+    try:
+        byte_range = attachments.parse_range(request.headers.get("Range"), attachment.size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{attachment.size}"
+        return response
+
+    try:
+        f = open(attachments.blob_path(attachment.blob_id), "rb")
+    except FileNotFoundError:
+        return JsonResponse({"error": "Attachment not found."}, status=404)
+    if byte_range is None:
+        response = FileResponse(f, as_attachment=True, filename=attachment.filename,
+                                content_type=attachment.content_type)
+    else:
+        start, end = byte_range
+        response = FileResponse(attachments.RangeFile(f, start, end), status=206, as_attachment=True,
+                                filename=attachment.filename, content_type=attachment.content_type)
+        response["Content-Range"] = f"bytes {start}-{end}/{attachment.size}"
+        response["Content-Length"] = end - start + 1
+    response["Accept-Ranges"] = "bytes"
+    return response
+
+
 def login_view(request): # all 3 of the following view functions are boilerplate and same as found in 
     # project 2 auctions
     if request.method == "POST":
@@ -210,11 +382,58 @@ def mailbox(request, mailbox): # to return a dynamically variable JsonResponse t
     # Return the instances in the q-set in reverse chronologial order using .order_by method and 
     # -timestamp for reverse. this is just ordering the instance in the q-set that's already built, 
     # so I really don't think .all() is needed here???
-    emails = emails.order_by("-timestamp").all()
-    # loop through through the instances of the q-set and call .serialize (custom method of the Email
-    # model) on each instance to convert each instance to a dictionary, within a json array(list).  Note
-    # need to set safe property to False bc jsonResponse will be expecting a dict and with safe=False, it
-    # will reject the list(array) we're sending it
+    emails = emails.order_by("-timestamp")
+
+    # ?group=thread lists only the newest email of each conversation, along with how many emails of the
+    # conversation are in this mailbox.  The window functions do the grouping inside the same query
+    grouped = request.GET.get("group") == "thread"
+    if grouped:
+        emails = emails.annotate(
+            thread_count=Window(Count("id"), partition_by=F("thread_id")),
+            thread_position=Window(RowNumber(), partition_by=F("thread_id"), order_by=F("timestamp").desc())
+        ).filter(thread_position=1)
+
+    # Clients that ask for it in their Accept header get the compact column-per-field format (see
+    # columnar.py), everyone else the usual list of serialized emails.  serialize reads the sender,
+    # recipients and attachments of every email, so those are fetched up front in three queries
+    # rather than three per email
+    serialized = emails.select_related("sender").prefetch_related("recipients", "attachments")
+    if columnar.wants_columns(request):
+        response = JsonResponse(columnar.encode(emails, grouped), content_type=columnar.CONTENT_TYPE)
+    elif grouped:
+        response = JsonResponse([
+            dict(email.serialize(), thread_count=email.thread_count) for email in serialized
+        ], safe=False)
+    else:
+        # loop through through the instances of the q-set and call .serialize (custom method of the Email
+        # model) on each instance to convert each instance to a dictionary, within a json array(list).  Note
+        # need to set safe property to False bc jsonResponse will be expecting a dict and with safe=False, it
+        # will reject the list(array) we're sending it
+        response = JsonResponse([email.serialize() for email in serialized], safe=False)
+    patch_vary_headers(response, ["Accept"])
+    return response
+
+@login_required
+def autocomplete(request):
+    # Suggests recipient addresses starting with ?prefix=, the caller's most frequent correspondents
+    # first.  Answered entirely from the in-memory index in autocomplete.py
+    recipient_index.ensure_built()
+    suggestions = recipient_index.complete(request.user.id, request.GET.get("prefix", "").strip())
+    return JsonResponse(suggestions, safe=False)
+
+@login_required
+def thread(request, thread_id):
+    # The whole conversation, oldest first.  Only the authenticated user's own copies are returned, found
+    # with a single lookup on the (user, thread_id, timestamp) index.  Three queries however long the
+    # thread: the emails with their senders, then one each for all their recipients and attachments
+    emails = list(
+        Email.objects.filter(user=request.user, thread_id=thread_id)
+        .order_by("timestamp")
+        .select_related("sender")
+        .prefetch_related("recipients", "attachments")
+    )
+    if not emails:
+        return JsonResponse({"error": "Thread not found."}, status=404)
     return JsonResponse([email.serialize() for email in emails], safe=False)
 
 def register(request):
@@ -238,6 +457,8 @@ def register(request):
             return render(request, "mail/register.html", {
                 "message": "Email address already taken."
             })
+        # the new address can be suggested to everyone straight away
+        recipient_index.add_user(user)
         login(request, user)
         return HttpResponseRedirect(reverse("index"))
     else:
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -42,6 +44,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'mail.middleware.StaticFilesMiddleware',
+    'mail.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -83,6 +87,65 @@ DATABASES = {
 
 AUTH_USER_MODEL = 'mail.User'
 
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+#
+# Point MAIL_CACHE_URL at a cache every worker process shares (redis://host:6379/0 or
+# memcached://host:11211) to have sessions and the user lookup done by AuthenticationMiddleware read
+# from it, so every API request can skip the django_session and mail_user queries.  Without one the
+# cache is per process, where a logout or password change in one worker would leave the others serving
+# the stale session and user, so sessions and users are then read from the database as usual
+
+MAIL_CACHE_URL = os.environ.get('MAIL_CACHE_URL', '')
+
+# The client library each cache needs is checked here, so a missing one stops startup with a clear
+# message instead of failing on the first request that touches the cache
+if MAIL_CACHE_URL.startswith(('redis://', 'rediss://')):
+    try:
+        import redis  # noqa: F401
+    except ImportError:
+        raise ImproperlyConfigured("MAIL_CACHE_URL names a Redis cache but the redis package isn't "
+                                   "installed.")
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': MAIL_CACHE_URL,
+        }
+    }
+elif MAIL_CACHE_URL.startswith('memcached://'):
+    try:
+        import pymemcache  # noqa: F401
+    except ImportError:
+        raise ImproperlyConfigured("MAIL_CACHE_URL names a memcached cache but the pymemcache package isn't "
+                                   "installed.")
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': MAIL_CACHE_URL[len('memcached://'):],
+        }
+    }
+elif MAIL_CACHE_URL:
+    raise ImproperlyConfigured("MAIL_CACHE_URL must start with redis://, rediss:// or memcached://")
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+if MAIL_CACHE_URL:
+    # Sessions are written through to the database but read from the cache
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+    # CachedModelBackend serves request.user from the cache (see mail/backends.py)
+    AUTHENTICATION_BACKENDS = [
+        'mail.backends.CachedModelBackend',
+    ]
+
+# Seconds a cached user is kept, as a bound on staleness should an invalidation be missed
+
+MAIL_USER_CACHE_TIMEOUT = 300
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -120,3 +183,48 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# collectstatic copies everything here under content-hashed names, with .gz and .br copies of text
+# files, and StaticFilesMiddleware serves it (see mail/storage.py and mail/middleware.py)
+
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'mail.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+
+# JSON responses at least this many bytes long are sent compressed to clients that accept it
+
+MAIL_COMPRESS_MIN_SIZE = 1024
+
+# Attachments (see mail/attachments.py).  Partial uploads and content-addressed blobs are kept on disk
+# under this directory
+
+MAIL_ATTACHMENT_ROOT = os.path.join(BASE_DIR, 'attachments')
+
+MAIL_ATTACHMENT_MAX_SIZE = 25 * 1024 * 1024
+
+# Unfinished uploads a user may have open at once.  Uploads older than this many hours, and files no
+# attachment uses any more, are removed by the cleanup_attachments command
+
+MAIL_ATTACHMENT_MAX_PENDING = 10
+
+MAIL_UPLOAD_MAX_AGE_HOURS = 24
+
+# Seconds between the background rebuilds of each process's recipient autocomplete index (see
+# mail/autocomplete.py), as a bound on how long users registered or emails sent through another process
+# go unseen
+
+MAIL_AUTOCOMPLETE_MAX_AGE = 300
+
+# The Email admin shows an estimated row count instead of running COUNT(*) once the table is bigger
+# than this, and runs its bulk actions this many rows at a time (see mail/admin.py)
+
+MAIL_ADMIN_ESTIMATE_THRESHOLD = 10000
+
+MAIL_ADMIN_CHUNK_SIZE = 1000
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project3.settings')
 
 application = get_wsgi_application()
+
+# Load every address into the recipient autocomplete index now rather than on the first request
+from mail import autocomplete  # noqa: E402
+
+autocomplete.warm()